@@ -1,7 +1,11 @@
+import functools
+import os
 import platform
 import random
+import re
 import shutil
 import string
+import tempfile
 import time
 import threading
 from pathlib import Path
@@ -9,33 +13,176 @@ from typing import Optional, Dict, Any
 import subprocess
 import psutil
 
+from fgi import zipalign
 from fgi.arguments import Arguments
-from fgi.cmd import run_command_and_check
+from fgi.cmd import run_command_and_check, run_streaming
 from fgi.loaders.base import BaseLoader
 from fgi.loaders.split import SplitAPKLoader
 from fgi.logger import Logger
 from fgi.utils.not_none import not_none
 
 
+@functools.lru_cache(maxsize=1)
+def _get_java_major_version() -> int:
+    """Detect the major Java version once per process; 0 when undetectable"""
+    try:
+        # `java -version` prints to stderr
+        output = subprocess.run(["java", "-version"], capture_output=True, text=True, timeout=10).stderr
+    except (OSError, subprocess.TimeoutExpired):
+        return 0
+
+    match = re.search(r'version "(\d+)(?:\.(\d+))?', output)
+    if match is None:
+        return 0
+
+    major = int(match.group(1))
+    if major == 1 and match.group(2):  # Java 8 and older report "1.8.0_..."
+        major = int(match.group(2))
+    Logger.debug(f"Detected Java major version: {major}")
+    return major
+
+
+# Written inside a cache entry after a successful populate so restores can
+# trust it without re-walking tens of thousands of smali files
+_CACHE_SENTINEL = ".fgi-cache-ok"
+
+
+def _move_fast(src: Path, dst: Path):
+    """Move a file, using a metadata-only rename when possible
+
+    shutil.move degrades to copy+delete across filesystems - for a 500MB
+    signed APK that's 500MB of I/O for what should be a rename.
+    """
+    try:
+        if src.stat().st_dev == dst.absolute().parent.stat().st_dev:
+            os.replace(src, dst)
+            return
+    except OSError:
+        pass
+    shutil.move(src, dst)
+
+
+def _has_any_smali(root: Path) -> bool:
+    """Check whether a directory tree contains at least one .smali file
+
+    Iterative os.scandir walk that returns on the first hit; DirEntry gives
+    the name and type without extra stat calls, unlike rglob which walks
+    (and stats) every file just to be counted.
+    """
+    stack = [str(root)]
+    while stack:
+        try:
+            with os.scandir(stack.pop()) as entries:
+                for entry in entries:
+                    if entry.is_dir(follow_symlinks=False):
+                        stack.append(entry.path)
+                    elif entry.name.endswith(".smali"):
+                        return True
+        except OSError:
+            continue
+    return False
+
+
+def _copy_file_range_copy(src: str, dst: str):
+    """Copy a single file in-kernel; reflinks the extents on CoW filesystems"""
+    with open(src, "rb") as fsrc, open(dst, "wb") as fdst:
+        remaining = os.fstat(fsrc.fileno()).st_size
+        while remaining > 0:
+            copied = os.copy_file_range(fsrc.fileno(), fdst.fileno(), remaining)
+            if copied == 0:
+                break
+            remaining -= copied
+    shutil.copystat(src, dst)
+
+
+def _clone_tree(src: Path, dst: Path):
+    """Snapshot a directory tree without moving bytes where possible
+
+    Uses in-kernel copies via os.copy_file_range (reflink on XFS/Btrfs)
+    when available, falling back to a plain byte-for-byte copy. Hardlinks
+    are deliberately NOT used: the restored tree is later mutated in place
+    (Smali.save/Manifest.save truncate-and-rewrite), which would write
+    through a shared inode straight into the cache entry. A decoded APK is
+    tens of thousands of small smali files, so reflinks turn the cache
+    round-trip from O(bytes) into O(inodes) on capable filesystems.
+    """
+    if hasattr(os, "copy_file_range"):
+        try:
+            shutil.copytree(src, dst, copy_function=_copy_file_range_copy, dirs_exist_ok=True)
+            return
+        except OSError as e:
+            Logger.debug(f"Tree clone via copy_file_range failed ({e}), falling back")
+            shutil.rmtree(dst, ignore_errors=True)
+
+    shutil.copytree(src, dst, dirs_exist_ok=True)
+
+
 class APKProcessor:
     """Optimized APK processor with parallel capabilities and performance monitoring"""
     
-    def __init__(self, apkeditor_path: Path):
+    def __init__(self, apkeditor_path: Path, debug_oom: bool = False):
         self.apkeditor_path = apkeditor_path
+        self.debug_oom = debug_oom
         self.performance_metrics: Dict[str, float] = {}
         self.process_lock = threading.Lock()
-        
+        self._jvm_args_cache: Dict[int, list[str]] = {}
+        self._cds_dump_started = False
+
+    def _get_cds_args(self) -> list[str]:
+        """JVM flags reusing a class-data-sharing archive across spawns
+
+        Every APKEditor call boots a fresh JVM that reloads and verifies the
+        same classes. With AppCDS (Java 13+) the first run dumps the loaded-
+        class archive next to the jar on exit, and every later run maps it
+        read-only - most of the class-loading part of JVM startup disappears
+        for the rest of the batch.
+        """
+        if _get_java_major_version() < 13:
+            return []
+
+        archive = self.apkeditor_path.with_suffix(".jsa")
+        if archive.exists():
+            # An archive dumped before the jar was last updated no longer
+            # matches its classes; drop it and re-dump below
+            if archive.stat().st_mtime < self.apkeditor_path.stat().st_mtime:
+                Logger.debug("AppCDS archive predates the APKEditor jar, re-dumping")
+                archive.unlink(missing_ok=True)
+            else:
+                return [f"-XX:SharedArchiveFile={archive}"]
+
+        # Only one child per process dumps the archive; parallel dumpers
+        # would race on the same file
+        with self.process_lock:
+            if self._cds_dump_started:
+                return []
+            self._cds_dump_started = True
+        return [f"-XX:ArchiveClassesAtExit={archive}"]
+
+    @functools.cached_property
+    def _sysinfo(self) -> tuple[Optional[int], Optional[int], Optional[int]]:
+        """Total/available memory (MB) and CPU count, queried once per processor
+
+        The values effectively never change during a run, and re-reading
+        /proc/meminfo for every spawned JVM adds up in batch mode.
+        """
+        memory = psutil.virtual_memory()
+        return memory.total // (1024 * 1024), memory.available // (1024 * 1024), psutil.cpu_count()
+
     def get_optimal_jvm_args(self, apk_size_mb: int) -> list[str]:
         """Get optimal JVM arguments based on APK size and system resources
         
         Note: All JVM flags used are compatible with Java 8+ to ensure
         broad compatibility across different Java versions.
         """
+        # Bucket APK sizes so close-sized APKs reuse the computed list
+        bucket = apk_size_mb // 64
+        cached_args = self._jvm_args_cache.get(bucket)
+        if cached_args is not None:
+            return list(cached_args)
+
         # Get total system memory (not just available) for better heap sizing
-        total_memory = psutil.virtual_memory().total // (1024 * 1024)  # MB
-        available_memory = psutil.virtual_memory().available // (1024 * 1024)  # MB
-        cpu_count = psutil.cpu_count()
-        
+        total_memory, available_memory, cpu_count = self._sysinfo
+
         if total_memory is None or available_memory is None or cpu_count is None:
             # Fallback to conservative values if system info unavailable
             total_memory = 8192  # 8GB default
@@ -43,30 +190,76 @@ class APKProcessor:
             cpu_count = 4  # 4 cores default
             Logger.warn("⚠️  System info unavailable, using conservative optimization values")
         
-        # Base JVM arguments
-        base_args = [
-            "-XX:+UseG1GC",
-            "-XX:MaxGCPauseMillis=200",
-            "-XX:+UseStringDeduplication",
-            "-XX:+UseCompressedOops",
-            "-XX:+UseCompressedClassPointers",
-            "-XX:G1HeapRegionSize=16m",
-        ]
-        
-        # Memory allocation based on APK size and total system memory
+        # Memory allocation based on APK size and total system memory.
+        # Size the heap first - the collector choice depends on it.
         if apk_size_mb > 500:  # Large APK
             heap_size = min(apk_size_mb * 4, total_memory // 4)
-            base_args.extend([
-                f"-Xmx{heap_size}m",
-                f"-Xms{heap_size // 4}m",
-            ])
         else:  # Small/medium APK
             heap_size = max(1536, min(apk_size_mb * 10, total_memory // 4))
-            base_args.extend([
-                f"-Xmx{heap_size}m",
-                f"-Xms{heap_size // 3}m",
-            ])
-        
+
+        # Collector selection: APKEditor is a single batch run, so past the
+        # point where G1's region heuristics stop scaling (>32GB heaps) pure
+        # throughput collectors win. Fall back to G1 when the Java version
+        # can't be detected or is too old for the alternatives.
+        java_major = _get_java_major_version()
+        use_g1 = heap_size <= 32768 or java_major < 11
+
+        if use_g1:
+            base_args = [
+                "-XX:+UseG1GC",
+                "-XX:+UseCompressedOops",
+                "-XX:+UseCompressedClassPointers",
+                # Dex/smali decoding has a very high short-lived allocation rate;
+                # G1's default 5% young-gen keeps minor GCs running constantly.
+                # Widen it so most garbage dies in the young generation.
+                "-XX:+UnlockExperimentalVMOptions",
+                "-XX:G1NewSizePercent=40",
+                "-XX:G1MaxNewSizePercent=60",
+            ]
+
+            # String dedup runs a background scan during concurrent marking
+            # that only pays off for processes living through many GC cycles;
+            # a short batch run just eats the CPU tax. Keep it for APKs big
+            # enough to decode for minutes.
+            if apk_size_mb > 1024:
+                base_args.append("-XX:+UseStringDeduplication")
+
+            # Region size scaled to the heap: APKEditor holds whole dex byte
+            # arrays, which become "humongous" (straight to old-gen) once they
+            # exceed half a region. Bigger heaps get bigger regions so fewer
+            # allocations cross that threshold; small heaps keep regions small
+            # and reserve extra headroom instead.
+            if heap_size < 8192:
+                base_args.extend([
+                    "-XX:G1HeapRegionSize=4m",
+                    "-XX:G1ReservePercent=15",
+                ])
+            elif heap_size <= 32768:
+                base_args.append("-XX:G1HeapRegionSize=16m")
+            else:
+                base_args.append("-XX:G1HeapRegionSize=32m")
+        elif java_major >= 15:
+            base_args = ["-XX:+UseZGC"]
+            if java_major >= 21:
+                base_args.append("-XX:+ZGenerational")
+        else:  # Java 11-14 with a huge heap: the throughput collector
+            base_args = ["-XX:+UseParallelGC"]
+
+        # Start the heap at half of -Xmx so the collector doesn't get stuck
+        # resizing from a tiny initial heap under allocation pressure
+        base_args.extend([
+            f"-Xmx{heap_size}m",
+            f"-Xms{heap_size // 2}m",
+        ])
+        if heap_size > 4096:
+            # Commit the heap pages at JVM startup (~1-2s) instead of minor-
+            # faulting them in one by one during the decode inner loop
+            base_args.append("-XX:+AlwaysPreTouch")
+        if use_g1 and apk_size_mb <= 500:
+            # Pause-time goal only for interactive-sized APKs; it biases G1
+            # toward tiny young-gens, which hurts throughput on large ones
+            base_args.append("-XX:MaxGCPauseMillis=200")
+
         # Thread optimization
         if cpu_count > 4:
             parallel_threads = cpu_count // 2
@@ -79,20 +272,25 @@ class APKProcessor:
         # Add additional performance flags
         base_args.extend([
             "-XX:+TieredCompilation",
-            "-XX:+HeapDumpOnOutOfMemoryError",
+            # Fail fast on OOM instead of letting back-to-back GCs fight the
+            # dying heap until the timeout hits
+            "-XX:+ExitOnOutOfMemoryError",
         ])
-        
-        # Add heap dump path for Windows systems
-        if platform.system() == "Windows":
-            heap_dump_path = "C:\\temp\\heapdump.hprof"
+
+        if self.debug_oom:
+            # Heap dumps are opt-in: dumping a multi-GB heap turns a fast
+            # failure into a multi-minute stall
             base_args.extend([
-                f"-XX:HeapDumpPath={heap_dump_path}",
+                "-XX:+HeapDumpOnOutOfMemoryError",
+                f"-XX:HeapDumpPath={tempfile.gettempdir()}",
             ])
-        
+
+        self._jvm_args_cache[bucket] = list(base_args)
         return base_args
     
-    def run_apkeditor_with_optimization(self, command: str, input_path: Path, output_path: Path, 
-                                       additional_args: Optional[list[str]] = None) -> str:
+    def run_apkeditor_with_optimization(self, command: str, input_path: Path, output_path: Path,
+                                       additional_args: Optional[list[str]] = None,
+                                       extra_jvm_args: Optional[list[str]] = None) -> str:
         """Run APKEditor with optimized parameters"""
         start_time = time.time()
         
@@ -116,9 +314,11 @@ class APKProcessor:
         
         # Get optimal JVM arguments
         jvm_args = self.get_optimal_jvm_args(apk_size)
-        
+        if extra_jvm_args:
+            jvm_args = jvm_args + extra_jvm_args
+
         # Build command with optimizations
-        cmd = ["java"] + jvm_args + [
+        cmd = ["java"] + jvm_args + self._get_cds_args() + [
             "-jar", str(self.apkeditor_path),
             command
         ]
@@ -151,49 +351,55 @@ class APKProcessor:
             cmd.extend(additional_args)
         
         try:
-            # Run with timeout and memory monitoring
-            process = subprocess.run(
+            # Stream child output instead of buffering it all in memory -
+            # decode of a large APK can log hundreds of MB of smali output.
+            # Only "info" actually consumes stdout; decode/build discard it.
+            returncode, stdout, stderr = run_streaming(
                 cmd,
-                capture_output=True,
-                text=True,
                 timeout=600,  # 10 minute timeout for complex APKs (increased from 5 minutes)
-                check=True
+                keep_stdout=command == "info",
             )
-            
-            execution_time = time.time() - start_time
-            self.performance_metrics[f"{command}_{input_path.name}"] = execution_time
-            
-            Logger.info(f"✅ APKEditor {command} completed in {execution_time:.2f}s")
-            return process.stdout
-            
         except subprocess.TimeoutExpired:
             Logger.error(f"❌ APKEditor {command} timed out after 10 minutes")
             raise RuntimeError(f"APKEditor {command} operation timed out")
-        except subprocess.CalledProcessError as e:
-            Logger.error(f"❌ APKEditor {command} failed: {e.stderr}")
-            
+
+        if returncode != 0:
+            Logger.error(f"❌ APKEditor {command} failed: {stderr}")
+
             # Check if it's a memory error and suggest fallback
-            if "OutOfMemoryError" in e.stderr or "Java heap space" in e.stderr:
+            if "OutOfMemoryError" in stderr or "Java heap space" in stderr:
                 Logger.error("💡 OutOfMemoryError detected! This APK requires more memory than allocated.")
                 Logger.error("💡 Consider using a machine with more RAM or try the jf DEX library fallback.")
-            
-            raise RuntimeError(f"APKEditor {command} failed: {e.stderr}")
+
+            raise RuntimeError(f"APKEditor {command} failed: {stderr}")
+
+        execution_time = time.time() - start_time
+        # The optimizer shares one processor across its worker threads
+        with self.process_lock:
+            self.performance_metrics[f"{command}_{input_path.name}"] = execution_time
+
+        Logger.info(f"✅ APKEditor {command} completed in {execution_time:.2f}s")
+        return stdout
     
     def get_performance_summary(self) -> str:
         """Get performance metrics summary"""
-        if not self.performance_metrics:
+        # Snapshot so the report stays consistent while workers keep writing
+        with self.process_lock:
+            metrics = dict(self.performance_metrics)
+
+        if not metrics:
             return "No performance data available"
-        
-        total_time = sum(self.performance_metrics.values())
-        avg_time = total_time / len(self.performance_metrics)
-        
+
+        total_time = sum(metrics.values())
+        avg_time = total_time / len(metrics)
+
         summary = f"📊 Performance Summary:\n"
-        summary += f"⏱️  Total time: {total_time:.2f}s | Operations: {len(self.performance_metrics)}\n"
+        summary += f"⏱️  Total time: {total_time:.2f}s | Operations: {len(metrics)}\n"
         summary += f"📈 Average: {avg_time:.2f}s per operation\n"
-        
-        for operation, time_taken in self.performance_metrics.items():
+
+        for operation, time_taken in metrics.items():
             summary += f"  • {operation}: {time_taken:.2f}s\n"
-        
+
         return summary
 
 
@@ -203,8 +409,15 @@ class APK:
         self.arguments = arguments
         self.loader = loader
         self.temp_path = self.arguments.temp_root_path / "".join(random.choices(string.ascii_letters, k=12))
-        self.processor = APKProcessor(apkeditor_path)
-        
+        self.processor = APKProcessor(apkeditor_path, arguments.debug_oom)
+
+        # Resolve the source name once; Path.absolute() hits os.getcwd()
+        # every time and these paths are used across every stage
+        source_name = self.loader.source.absolute().name
+        self._built_apk_path = self.arguments.temp_root_path / (source_name + "-built")
+        self._zipaligned_apk_path = self.arguments.temp_root_path / (source_name + "-zipaligned")
+        self._signed_apk_path = self.arguments.temp_root_path / (source_name + "-signed")
+
         # Create cache directory for performance optimization
         self.cache_dir = self.arguments.temp_root_path / "cache"
         self.cache_dir.mkdir(exist_ok=True)
@@ -216,18 +429,6 @@ class APK:
                 shutil.rmtree(self.cache_dir)
                 self.cache_dir.mkdir(exist_ok=True)
 
-    @property
-    def _built_apk_path(self):
-        return self.arguments.temp_root_path / (self.loader.source.absolute().name + "-built")
-
-    @property
-    def _zipaligned_apk_path(self):
-        return self.arguments.temp_root_path / (self.loader.source.absolute().name + "-zipaligned")
-
-    @property
-    def _signed_apk_path(self):
-        return self.arguments.temp_root_path / (self.loader.source.absolute().name + "-signed")
-
     def decode(self):
         Logger.info(f"Decoding APK to {self.temp_path}...")
         
@@ -238,18 +439,20 @@ class APK:
         if cache_file.exists() and self.arguments.use_cache and not self.arguments.force_fresh:
             Logger.info("📋 Using cached decompilation...")
             # Restore from cache
-            shutil.copytree(cache_file, self.temp_path, dirs_exist_ok=True)
-            
+            _clone_tree(cache_file, self.temp_path)
+            # Keep the sentinel out of the decoded tree so it can't end up in the built APK
+            (self.temp_path / _CACHE_SENTINEL).unlink(True)
+
+            # Trust the sentinel written after a successful populate; only
+            # fall back to walking the smali dirs when it is missing
+            if (cache_file / _CACHE_SENTINEL).exists():
+                return
+
             # Verify cache integrity - check if Smali files exist
             smali_dirs = ["smali", "smali_classes2", "smali_classes3", "smali_classes4", "smali_classes5", "smali_classes6"]
-            total_smali_files = 0
-            for dir_name in smali_dirs:
-                smali_dir = self.temp_path / dir_name
-                if smali_dir.exists():
-                    smali_files = list(smali_dir.rglob("*.smali"))
-                    total_smali_files += len(smali_files)
-            
-            if total_smali_files == 0:
+            has_smali_files = any(_has_any_smali(self.temp_path / dir_name) for dir_name in smali_dirs)
+
+            if not has_smali_files:
                 Logger.warn("⚠️ Cache corrupted - forcing fresh decompilation")
                 # Remove corrupted cache
                 if cache_file.exists():
@@ -266,14 +469,17 @@ class APK:
                 # Cache the fresh result
                 if self.arguments.use_cache:
                     try:
-                        shutil.copytree(self.temp_path, cache_file, dirs_exist_ok=True)
+                        _clone_tree(self.temp_path, cache_file)
+                        (cache_file / _CACHE_SENTINEL).touch()
                     except Exception as e:
                         Logger.warn(f"Failed to cache: {e}")
-                
+
                 decode_time = time.time() - start_time
                 Logger.info(f"✅ Decompiled in {decode_time:.1f}s")
                 return
             else:
+                # Backfill the sentinel so the next restore skips the scan
+                (cache_file / _CACHE_SENTINEL).touch()
                 return
         
         # Perform decompilation
@@ -288,7 +494,8 @@ class APK:
         # Cache the result if caching is enabled
         if self.arguments.use_cache:
             try:
-                shutil.copytree(self.temp_path, cache_file, dirs_exist_ok=True)
+                _clone_tree(self.temp_path, cache_file)
+                (cache_file / _CACHE_SENTINEL).touch()
             except Exception as e:
                 Logger.warn(f"Failed to cache: {e}")
         
@@ -312,16 +519,23 @@ class APK:
         Logger.info("📦 Zipaligning...")
         
         start_time = time.time()
-        _ = run_command_and_check(
-            [
-                "zipalign",
-                "-p",
-                "4",
-                self._built_apk_path,
-                self._zipaligned_apk_path,
-            ]
-        )
-        
+        try:
+            # Pure header rewrite in-process: skips a subprocess spawn and a
+            # second full parse of the archive by the zipalign binary
+            zipalign.align(self._built_apk_path, self._zipaligned_apk_path)
+        except Exception as e:
+            Logger.debug(f"In-process zipalign failed ({e}), falling back to zipalign binary")
+            self._zipaligned_apk_path.unlink(missing_ok=True)
+            _ = run_command_and_check(
+                [
+                    "zipalign",
+                    "-p",
+                    "4",
+                    self._built_apk_path,
+                    self._zipaligned_apk_path,
+                ]
+            )
+
         zipalign_time = time.time() - start_time
         Logger.info(f"✅ Zipaligned in {zipalign_time:.1f}s")
         
@@ -358,7 +572,7 @@ class APK:
         
         start_time = time.time()
         # Move APK to track stage if any error
-        shutil.move(self._zipaligned_apk_path, self._signed_apk_path)
+        _move_fast(self._zipaligned_apk_path, self._signed_apk_path)
 
         apksigner_executable = "apksigner"
 
@@ -382,7 +596,7 @@ class APK:
         sign_time = time.time() - start_time
         Logger.info(f"✅ Signed in {sign_time:.1f}s")
         
-        shutil.move(
+        _move_fast(
             self._signed_apk_path,
             not_none(self.arguments.out),  # pyright: ignore[reportArgumentType]
         )  # XXX: assume that everything is ready
@@ -408,12 +622,16 @@ class APK:
         """Get performance summary for this APK processing session"""
         return self.processor.get_performance_summary()
 
-    def __del__(self):
+    def cleanup(self):
         if not self.arguments.no_cleanup and self.temp_path.exists():
             shutil.rmtree(self.temp_path)
-        # GC everything if program died before GC in function
         if isinstance(self.loader, SplitAPKLoader) and self.loader.merge_temp_path.exists():
             shutil.rmtree(self.loader.merge_temp_path)
         self._built_apk_path.unlink(True)
         self._zipaligned_apk_path.unlink(True)
         self._signed_apk_path.unlink(True)
+
+    def __del__(self):
+        # Backstop if the program died before the explicit cleanup() call;
+        # every step above is idempotent
+        self.cleanup()
@@ -9,16 +9,19 @@ This module provides advanced optimization features for APKEditor operations:
 - Performance monitoring
 """
 
+import atexit
 import os
 import threading
 import time
-from concurrent.futures import ThreadPoolExecutor, as_completed
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
 from pathlib import Path
 from typing import Dict, List, Optional, Tuple, Any
 import json
-import hashlib
 import shutil
 
+import psutil
+
+from fgi.apk import APKProcessor
 from fgi.logger import Logger
 
 
@@ -28,10 +31,31 @@ class APKEditorOptimizer:
     def __init__(self, apkeditor_path: Path, max_workers: Optional[int] = None):
         self.apkeditor_path = apkeditor_path
         self.max_workers = max_workers or min(4, os.cpu_count() or 4)
+        # Share the tuned JVM args and command-line flags with the main flow
+        self.processor = APKProcessor(apkeditor_path)
         self.cache_dir = Path.home() / ".fgi" / "apkeditor_cache"
         self.cache_dir.mkdir(parents=True, exist_ok=True)
         self.performance_cache = self.cache_dir / "performance.json"
+        self._cache_dirty = False
         self._load_performance_cache()
+        # Updates are batched in memory; rewriting the whole JSON file after
+        # every operation turns a long batch run into quadratic I/O
+        atexit.register(self._save_performance_cache)
+
+        # max_workers JVMs each sized against system memory can overcommit
+        # RAM badly enough that a batch run ends up slower than serial.
+        # Admit only as many concurrent children as worst-case heaps fit
+        # into currently available memory.
+        memory = psutil.virtual_memory()
+        worst_case_heap_mb = max(1024, (memory.total // (1024 * 1024)) // 4)
+        self._heap_slots = threading.Semaphore(max(1, (memory.available // (1024 * 1024)) // worst_case_heap_mb))
+
+        # Cap GC threads per child so N parallel JVMs don't each spawn
+        # cpu_count GC threads and oversubscribe the machine
+        self._child_gc_args = [
+            f"-XX:ParallelGCThreads={max(1, (os.cpu_count() or 4) // self.max_workers)}",
+            "-XX:ConcGCThreads=1",
+        ]
         
     def _load_performance_cache(self):
         """Load performance cache from disk"""
@@ -45,10 +69,13 @@ class APKEditorOptimizer:
             self.performance_data = {}
     
     def _save_performance_cache(self):
-        """Save performance cache to disk"""
+        """Flush the performance cache to disk if it has pending updates"""
+        if not self._cache_dirty:
+            return
         try:
             with open(self.performance_cache, 'w') as f:
                 json.dump(self.performance_data, f, indent=2)
+            self._cache_dirty = False
         except IOError:
             Logger.warn("Failed to save performance cache")
     
@@ -56,9 +83,9 @@ class APKEditorOptimizer:
         """Generate fingerprint for APK based on size and modification time"""
         try:
             stat = apk_path.stat()
-            # Use size and mtime for fingerprint
-            fingerprint_data = f"{stat.st_size}_{stat.st_mtime}"
-            return hashlib.md5(fingerprint_data.encode()).hexdigest()
+            # Size + mtime is already a unique-enough cache key; hashing the
+            # pair with MD5 only added setup/finalize overhead per call
+            return f"{stat.st_size:x}-{stat.st_mtime_ns:x}"
         except OSError:
             return ""
     
@@ -87,37 +114,54 @@ class APKEditorOptimizer:
             "success": success,
             "apk_size": apk_path.stat().st_size if apk_path.exists() else 0
         }
-        self._save_performance_cache()
+        self._cache_dirty = True
     
+    def _run_parallel(self, input_paths: List[Path], worker, output_dir: Path, verb: str, verb_past: str) -> Dict[Path, Path]:
+        """Run a worker over many inputs with a bounded in-flight window
+
+        Submitting every path up-front keeps N pending commands (and their
+        argument strings/buffers) alive before the first worker even starts;
+        capping live futures at 2*max_workers makes peak memory constant
+        regardless of batch size.
+        """
+        results: Dict[Path, Path] = {}
+        failed: List[Path] = []
+        window = 2 * self.max_workers
+
+        with ThreadPoolExecutor(max_workers=self.max_workers) as executor:
+            pending: Dict[Any, Path] = {}
+            paths_iter = iter(input_paths)
+
+            while True:
+                while len(pending) < window:
+                    input_path = next(paths_iter, None)
+                    if input_path is None:
+                        break
+                    pending[executor.submit(worker, input_path, output_dir)] = input_path
+
+                if not pending:
+                    break
+
+                done, _ = wait(pending, return_when=FIRST_COMPLETED)
+                for future in done:
+                    input_path = pending.pop(future)
+                    try:
+                        results[input_path] = future.result()
+                        Logger.info(f"Successfully {verb_past} {input_path.name}")
+                    except Exception as e:
+                        Logger.error(f"Failed to {verb} {input_path.name}: {e}")
+                        failed.append(input_path)
+
+        if failed:
+            Logger.warn(f"Failed to {verb} {len(failed)} APKs: {[path.name for path in failed]}")
+
+        self._save_performance_cache()
+        return results
+
     def parallel_decode_apks(self, apk_paths: List[Path], output_dir: Path) -> Dict[Path, Path]:
         """Decode multiple APKs in parallel"""
         Logger.info(f"Starting parallel decode of {len(apk_paths)} APKs with {self.max_workers} workers")
-        
-        results = {}
-        failed_apks = []
-        
-        with ThreadPoolExecutor(max_workers=self.max_workers) as executor:
-            # Submit all decode tasks
-            future_to_apk = {
-                executor.submit(self._decode_single_apk, apk_path, output_dir): apk_path
-                for apk_path in apk_paths
-            }
-            
-            # Process completed tasks
-            for future in as_completed(future_to_apk):
-                apk_path = future_to_apk[future]
-                try:
-                    output_path = future.result()
-                    results[apk_path] = output_path
-                    Logger.info(f"Successfully decoded {apk_path.name}")
-                except Exception as e:
-                    Logger.error(f"Failed to decode {apk_path.name}: {e}")
-                    failed_apks.append(apk_path)
-        
-        if failed_apks:
-            Logger.warn(f"Failed to decode {len(failed_apks)} APKs: {[apk.name for apk in failed_apks]}")
-        
-        return results
+        return self._run_parallel(apk_paths, self._decode_single_apk, output_dir, "decode", "decoded")
     
     def _decode_single_apk(self, apk_path: Path, output_dir: Path) -> Path:
         """Decode a single APK with optimization"""
@@ -133,19 +177,18 @@ class APKEditorOptimizer:
         output_path.mkdir(parents=True, exist_ok=True)
         
         try:
-            # Run APKEditor decode with optimization
-            cmd = [
-                "java", "-jar", str(self.apkeditor_path),
-                "d", "-i", str(apk_path), "-o", str(output_path),
-                "-f", "-clean-meta"  # Force overwrite and clean metadata
-            ]
-            
-            import subprocess
-            result = subprocess.run(cmd, capture_output=True, text=True, timeout=300)
-            
-            if result.returncode != 0:
-                raise RuntimeError(f"APKEditor decode failed: {result.stderr}")
-            
+            # Run APKEditor decode through the shared processor so parallel
+            # decodes get the same tuned JVM args and decode flags as the
+            # main flow - just with per-child GC thread caps on top
+            with self._heap_slots:
+                _ = self.processor.run_apkeditor_with_optimization(
+                    "d",
+                    apk_path,
+                    output_path,
+                    additional_args=["-clean-meta"],
+                    extra_jvm_args=self._child_gc_args,
+                )
+
             execution_time = time.time() - start_time
             self.update_performance_cache(apk_path, "decode", execution_time, True)
             
@@ -160,32 +203,7 @@ class APKEditorOptimizer:
     def parallel_build_apks(self, decoded_paths: List[Path], output_dir: Path) -> Dict[Path, Path]:
         """Build multiple decoded APKs in parallel"""
         Logger.info(f"Starting parallel build of {len(decoded_paths)} APKs with {self.max_workers} workers")
-        
-        results = {}
-        failed_builds = []
-        
-        with ThreadPoolExecutor(max_workers=self.max_workers) as executor:
-            # Submit all build tasks
-            future_to_path = {
-                executor.submit(self._build_single_apk, decoded_path, output_dir): decoded_path
-                for decoded_path in decoded_paths
-            }
-            
-            # Process completed tasks
-            for future in as_completed(future_to_path):
-                decoded_path = future_to_path[future]
-                try:
-                    output_path = future.result()
-                    results[decoded_path] = output_path
-                    Logger.info(f"Successfully built {decoded_path.name}")
-                except Exception as e:
-                    Logger.error(f"Failed to build {decoded_path.name}: {e}")
-                    failed_builds.append(decoded_path)
-        
-        if failed_builds:
-            Logger.warn(f"Failed to build {len(failed_builds)} APKs: {[path.name for path in failed_builds]}")
-        
-        return results
+        return self._run_parallel(decoded_paths, self._build_single_apk, output_dir, "build", "built")
     
     def _build_single_apk(self, decoded_path: Path, output_dir: Path) -> Path:
         """Build a single decoded APK with optimization"""
@@ -195,19 +213,15 @@ class APKEditorOptimizer:
         output_path = output_dir / f"{decoded_path.name}-built.apk"
         
         try:
-            # Run APKEditor build with optimization
-            cmd = [
-                "java", "-jar", str(self.apkeditor_path),
-                "b", "-i", str(decoded_path), "-o", str(output_path),
-                "-f"  # Force overwrite
-            ]
-            
-            import subprocess
-            result = subprocess.run(cmd, capture_output=True, text=True, timeout=300)
-            
-            if result.returncode != 0:
-                raise RuntimeError(f"APKEditor build failed: {result.stderr}")
-            
+            # Run APKEditor build through the shared processor (see _decode_single_apk)
+            with self._heap_slots:
+                _ = self.processor.run_apkeditor_with_optimization(
+                    "b",
+                    decoded_path,
+                    output_path,
+                    extra_jvm_args=self._child_gc_args,
+                )
+
             execution_time = time.time() - start_time
             self.update_performance_cache(decoded_path, "build", execution_time, True)
             
@@ -245,22 +259,39 @@ class APKEditorOptimizer:
             return {"message": "No performance data available"}
         
         total_operations = len(self.performance_data)
-        successful_operations = sum(1 for data in self.performance_data.values() if data.get("success", False))
+        successful_operations = 0
+        decode_operations = 0
+        build_operations = 0
+        decode_times: List[float] = []
+        build_times: List[float] = []
+
+        # Single pass over the cache. The old comprehensions re-materialized
+        # the full key list per entry (O(N^2)) and, worse, only ever tested
+        # the *first* key - the timing buckets were semantically wrong.
+        for key, data in self.performance_data.items():
+            is_decode = key.startswith("decode_")
+            is_build = key.startswith("build_")
+            if is_decode:
+                decode_operations += 1
+            elif is_build:
+                build_operations += 1
+            if not data.get("success", False):
+                continue
+            successful_operations += 1
+            if is_decode:
+                decode_times.append(data["execution_time"])
+            elif is_build:
+                build_times.append(data["execution_time"])
+
         failed_operations = total_operations - successful_operations
-        
-        # Calculate timing statistics
-        decode_times = [data["execution_time"] for data in self.performance_data.values() 
-                       if data.get("success", False) and "decode" in list(self.performance_data.keys())[0]]
-        build_times = [data["execution_time"] for data in self.performance_data.values() 
-                      if data.get("success", False) and "build" in list(self.performance_data.keys())[0]]
-        
+
         stats = {
             "total_operations": total_operations,
             "successful_operations": successful_operations,
             "failed_operations": failed_operations,
             "success_rate": (successful_operations / total_operations * 100) if total_operations > 0 else 0,
-            "decode_operations": len([k for k in self.performance_data.keys() if "decode" in k]),
-            "build_operations": len([k for k in self.performance_data.keys() if "build" in k]),
+            "decode_operations": decode_operations,
+            "build_operations": build_operations,
         }
         
         if decode_times:
@@ -282,6 +313,7 @@ class APKEditorOptimizer:
                 shutil.rmtree(self.cache_dir)
                 self.cache_dir.mkdir(parents=True, exist_ok=True)
             self.performance_data = {}
+            self._cache_dirty = True
             self._save_performance_cache()
             Logger.info("APKEditor cache cleared")
         except Exception as e:
@@ -28,6 +28,7 @@ class Arguments:
     verbose: bool
     use_cache: bool
     force_fresh: bool
+    debug_oom: bool
 
     @staticmethod
     def create():
@@ -100,6 +101,11 @@ class Arguments:
             action="store_true",
             help="Force fresh decompilation (ignore cache)",
         )
+        _ = parser.add_argument(
+            "--debug-oom",
+            action="store_true",
+            help="Write a heap dump to the temp directory when APKEditor runs out of memory (slow for big heaps)",
+        )
 
         args = parser.parse_args()
         return Arguments(
@@ -117,6 +123,7 @@ class Arguments:
             args.verbose,  # pyright: ignore[reportAny]
             args.use_cache,  # pyright: ignore[reportAny]
             args.force_fresh,  # pyright: ignore[reportAny]
+            args.debug_oom,  # pyright: ignore[reportAny]
         )
 
     def validate(self):
@@ -92,5 +92,9 @@ class Cache:
     def get_key_path(self) -> Path:
         return self.home / "debug.keystore"
 
+    def close(self):
+        self._close_metadata()
+
     def __del__(self):
+        # Backstop only; callers should close() explicitly
         self._close_metadata()
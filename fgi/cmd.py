@@ -1,8 +1,19 @@
+import os
+import shutil
+import signal
 import subprocess
+import tempfile
+import threading
 from pathlib import Path
 
+import psutil
+
 from fgi.logger import Logger
 
+# Only the tail of stderr is kept for error reporting; it is enough to
+# detect OutOfMemoryError and friends without pinning megabytes of log.
+STDERR_TAIL_BYTES = 64 * 1024
+
 
 def run_command_and_check(cmd: list[str | Path]):
     try:
@@ -10,3 +21,82 @@ def run_command_and_check(cmd: list[str | Path]):
         return subprocess.check_output(cmd, stderr=subprocess.STDOUT).decode()
     except subprocess.CalledProcessError as e:
         raise RuntimeError(f"Command {cmd} returned non-zero exit status: {e.output.decode()}")  # pyright: ignore[reportAny]
+
+
+def _kill_process_tree(process: subprocess.Popen):
+    """Kill a timed-out child along with everything it spawned
+
+    A JVM may have launched helpers (d8, aapt2, ...) that would otherwise
+    survive the parent and keep holding locks on the temp directory.
+    """
+    try:
+        if os.name == "posix":
+            os.killpg(os.getpgid(process.pid), signal.SIGKILL)
+        else:
+            process.send_signal(signal.CTRL_BREAK_EVENT)
+    except OSError:
+        pass
+
+    # Belt and suspenders for anything that escaped the process group
+    try:
+        for child in psutil.Process(process.pid).children(recursive=True):
+            child.kill()
+    except psutil.Error:
+        pass
+
+    process.kill()
+
+
+def run_streaming(cmd: list[str], timeout: float, keep_stdout: bool = True) -> tuple[int, str, str]:
+    """Run a command draining stdout/stderr as the child produces them.
+
+    Unlike `subprocess.run(capture_output=True)` the output is never held in
+    Python memory in full: stdout spills to a temporary file once it grows
+    past 16 MB (or is discarded entirely when `keep_stdout` is False), and
+    only the last 64 KB of stderr are retained.
+    Returns `(returncode, stdout, stderr_tail)`.
+    """
+    Logger.debug(f"Running {cmd}")
+    # Run the child in its own process group/session so a timeout can reap
+    # the entire tree, not just the immediate process
+    group_kwargs = {"preexec_fn": os.setsid} if os.name == "posix" else {"creationflags": subprocess.CREATE_NEW_PROCESS_GROUP}
+    process = subprocess.Popen(cmd, stdout=subprocess.PIPE, stderr=subprocess.PIPE, bufsize=1 << 20, **group_kwargs)
+    stdout_file = tempfile.SpooledTemporaryFile(max_size=16 << 20) if keep_stdout else None
+    stderr_tail = bytearray()
+
+    def drain_stdout():
+        if stdout_file is not None:
+            shutil.copyfileobj(process.stdout, stdout_file, 1 << 20)
+        else:
+            while process.stdout.read(1 << 20):
+                pass
+
+    def drain_stderr():
+        while True:
+            chunk = process.stderr.read(65536)
+            if not chunk:
+                break
+            stderr_tail.extend(chunk)
+            if len(stderr_tail) > STDERR_TAIL_BYTES:
+                del stderr_tail[:-STDERR_TAIL_BYTES]
+
+    threads = [threading.Thread(target=drain_stdout, daemon=True), threading.Thread(target=drain_stderr, daemon=True)]
+    for thread in threads:
+        thread.start()
+
+    try:
+        returncode = process.wait(timeout=timeout)
+    except subprocess.TimeoutExpired:
+        _kill_process_tree(process)
+        process.wait()
+        raise
+    finally:
+        for thread in threads:
+            thread.join()
+
+    stdout = ""
+    if stdout_file is not None:
+        stdout_file.seek(0)
+        stdout = stdout_file.read().decode(errors="replace")
+        stdout_file.close()
+    return returncode, stdout, stderr_tail.decode(errors="replace")
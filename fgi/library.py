@@ -1,5 +1,5 @@
 from pathlib import Path
-from shutil import copy
+from shutil import copy, copyfileobj
 
 from fgi.constants import ARCHITECTURES
 from fgi.logger import Logger
@@ -68,8 +68,21 @@ class Library:
             ) as f:
                 f.write(config)
 
-    def copy_script(self, script_name: str, script: bytes):
+    def copy_config_file(self, config_path: Path):
+        # Custom configs come straight from disk; stream them instead of
+        # round-tripping the whole file through a str
+        for arch in self.architectures:
+            Logger.debug(f"Copying {arch} config")
+            with open(config_path, "rb") as src, open(
+                self.get_arch_path(arch) / self.library_name.replace(".so", ".config.so"),
+                "wb+",
+            ) as dst:
+                copyfileobj(src, dst, 65536)
+
+    def copy_script(self, script_name: str, script_path: Path):
+        # Stream in 64 KiB chunks instead of materializing the whole script
+        # in memory once per call
         for arch in self.architectures:
             Logger.debug(f"Copying {script_name} / {arch}")
-            with open(self.get_arch_path(arch) / script_name, "wb+") as f:
-                f.write(script)
+            with open(script_path, "rb") as src, open(self.get_arch_path(arch) / script_name, "wb+") as dst:
+                copyfileobj(src, dst, 65536)
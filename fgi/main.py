@@ -1,5 +1,5 @@
-import traceback
 import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
 
 from fgi.apk import APK
 from fgi.arguments import Arguments
@@ -8,7 +8,7 @@ from fgi.frida_config import CONFIG_TYPES
 from fgi.library import Library
 from fgi.logger import Logger
 from fgi.manifest import Manifest
-from fgi.smali import Smali
+from fgi.smali import Smali, _collect_smali
 
 
 class App:
@@ -25,8 +25,13 @@ class App:
         cache.ensure()
 
         if not arguments.offline_mode:
-            cache.check_and_download_frida()
-            cache.check_and_download_apkeditor()
+            # The two downloads hit different hosts and share no state, so
+            # overlap them; the slower one bounds the wait instead of the sum
+            with ThreadPoolExecutor(max_workers=2) as executor:
+                frida_future = executor.submit(cache.check_and_download_frida)
+                apkeditor_future = executor.submit(cache.check_and_download_apkeditor)
+                frida_future.result()
+                apkeditor_future.result()
         else:
             Logger.warn("Skipping update check for deps")
 
@@ -47,11 +52,10 @@ class App:
         # Perform Smali injection for Frida Gadget loading
         smali_injection_performed = False
         try:
-            smali = Smali.find(apk.temp_path, entrypoint)
-            Logger.info("🔍 Injecting Frida Gadget into Smali...")
-            smali.perform_injection(arguments.library_name)
-            smali_injection_performed = True
-            del smali
+            with Smali.find(apk.temp_path, entrypoint) as smali:
+                Logger.info("🔍 Injecting Frida Gadget into Smali...")
+                smali.perform_injection(arguments.library_name)
+                smali_injection_performed = True
             Logger.info("✅ Smali injection completed")
         except RuntimeError as e:
             Logger.warn(f"⚠️ Primary injection failed: {e}")
@@ -59,24 +63,40 @@ class App:
             # Try alternative injection targets
             try:
                 alternative_targets = ["UnityPlayerActivity", "UnityPlayer", "MainActivity", "LauncherActivity"]
-                
+
+                # One filesystem walk shared by all targets; re-running a
+                # full rglob per target re-stats every smali file
+                all_smali = _collect_smali(apk.temp_path)
+
+                # First file matching each target name, deduplicated
+                candidates = []
                 for target in alternative_targets:
-                    try:
-                        smali_files = list(apk.temp_path.rglob("*.smali"))
-                        for smali_file in smali_files:
-                            if target in smali_file.name:
-                                Logger.info(f"🎯 Using alternative target: {smali_file.name}")
-                                smali = Smali(smali_file)
-                                smali.perform_injection(arguments.library_name)
-                                smali_injection_performed = True
-                                del smali
-                                Logger.info("✅ Alternative injection completed")
-                                break
-                        if smali_injection_performed:
+                    for smali_file in all_smali:
+                        if target in smali_file.name and smali_file not in candidates:
+                            candidates.append(smali_file)
                             break
-                    except Exception:
-                        continue
-                
+
+                def try_inject(path):
+                    candidate = Smali(path)
+                    candidate.perform_injection(arguments.library_name)
+                    return candidate
+
+                # The attempts are independent and only one needs to stick,
+                # so run them concurrently and persist just the first winner
+                if candidates:
+                    with ThreadPoolExecutor(max_workers=len(candidates)) as executor:
+                        futures = [executor.submit(try_inject, path) for path in candidates]
+                        for future in as_completed(futures):
+                            try:
+                                winner = future.result()
+                            except Exception:
+                                continue
+                            Logger.info(f"🎯 Using alternative target: {winner.path.name}")
+                            winner.save()
+                            smali_injection_performed = True
+                            Logger.info("✅ Alternative injection completed")
+                            break
+
                 if not smali_injection_performed:
                     raise RuntimeError(f"All injection methods failed")
                     
@@ -100,31 +120,31 @@ class App:
                 CONFIG_TYPES[arguments.config_type] % arguments.script_name if arguments.is_script_required() else CONFIG_TYPES[arguments.config_type]
             )
         else:
-            with open(arguments.config_path, "r", encoding="utf8") as f:
-                config = f.read()
-                library.copy_config(config)
+            library.copy_config_file(arguments.config_path)
 
         if arguments.is_script_required():
-            with open(arguments.script_path, "rb") as f:
-                script = f.read()
-                library.copy_script(arguments.script_name, script)
-        del library
+            library.copy_script(arguments.script_name, arguments.script_path)
 
         manifest = Manifest(apk.temp_path / "AndroidManifest.xml")
         manifest.enable_extract_native_libs()
-        del manifest
+        manifest.save()
 
-        # Build APK
+        # Build APK. Debug-key generation is independent of the build, so
+        # overlap the keytool run with it instead of serializing the two.
         Logger.info("🔨 Building patched APK...")
-        apk.build()
+        with ThreadPoolExecutor(max_workers=1) as executor:
+            key_future = None
+            if not cache.get_key_path().exists():
+                key_future = executor.submit(apk.generate_debug_key, cache.get_key_path())
+            apk.build()
+            if key_future is not None:
+                _ = key_future.result()
         apk.zipalign()
-        if not cache.get_key_path().exists():
-            apk.generate_debug_key(cache.get_key_path())
         apk.sign(cache.get_key_path())
-        
-        del apk
-        del cache
-        
+
+        apk.cleanup()
+        cache.close()
+
         total_time = time.time() - start_time
         Logger.info(f"✅ APK patching completed in {total_time:.1f}s")
         Logger.info(f"📱 Output: {arguments.out}")
@@ -139,6 +159,9 @@ def main():
     except (RuntimeError, AssertionError) as e:
         Logger.error(str(e))
     except Exception as e:
+        # Only needed on the crash path; keep it off the startup imports
+        import traceback
+
         Logger.error(f"Unexpected exception: {e}")
         Logger.error(traceback.format_exc())
 
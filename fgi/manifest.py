@@ -21,5 +21,5 @@ class Manifest:
             Logger.debug("Enabling extractNativeLibs in manifest")
             application_tag.attrib["{http://schemas.android.com/apk/res/android}extractNativeLibs"] = "true"
 
-    def __del__(self):
+    def save(self):
         self.content.write(self.path, encoding="utf8", xml_declaration=True)
@@ -10,6 +10,7 @@ This module provides a CLI for the APKEditor optimizer with commands for:
 
 import argparse
 import sys
+from concurrent.futures import ThreadPoolExecutor
 from pathlib import Path
 from typing import List
 
@@ -40,11 +41,14 @@ def parallel_process_command(args):
     # Convert input paths to Path objects
     input_paths = [Path(p) for p in args.input]
     
-    # Validate input paths
-    for path in input_paths:
-        if not path.exists():
+    # Validate input paths; each exists() is a stat syscall, so batch them
+    # on a thread pool and report every missing path instead of the first
+    with ThreadPoolExecutor(max_workers=min(32, len(input_paths))) as executor:
+        missing = [path for path, ok in zip(input_paths, executor.map(Path.exists, input_paths)) if not ok]
+    if missing:
+        for path in missing:
             Logger.error(f"Input path does not exist: {path}")
-            return 1
+        return 1
     
     Logger.info(f"Starting parallel processing of {len(input_paths)} APKs")
     
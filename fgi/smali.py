@@ -1,134 +1,164 @@
+import functools
+import os
+import re
 from pathlib import Path
 
 from fgi.constants import SMALI_FULL_LOAD_LIBRARY, SMALI_PARTIAL_LOAD_LIBRARY
 from fgi.logger import Logger
 
+# All possible Smali directories APKEditor may emit
+SMALI_DIRS = ("smali", "smali_classes2", "smali_classes3", "smali_classes4", "smali_classes5", "smali_classes6")
+
+# Class-name fragments that usually mark an injectable entry activity.
+# Compiled once into a single alternation so the fallback search does one
+# C-level scan per filename instead of nine Python substring checks.
+UNITY_PATTERNS = [
+    "UnityPlayer", "UnityActivity", "MessagingUnityPlayer", "Unity",
+    "Firebase", "Messaging", "Player", "Activity", "Main"
+]
+_UNITY_RE = re.compile("|".join(map(re.escape, UNITY_PATTERNS)))
+
+# Matches a .locals directive, capturing the prefix and the register count
+_LOCALS_RE = re.compile(r"^(\s*\.locals\s+)(\d+)")
+
+
+def _collect_smali(temp_path: Path) -> list[Path]:
+    """Collect every .smali path under the known smali dirs in one walk"""
+    collected: list[Path] = []
+    for dir_name in SMALI_DIRS:
+        for root, _, files in os.walk(temp_path / dir_name, followlinks=False):
+            root_path = Path(root)
+            for name in files:
+                if name.endswith(".smali"):
+                    collected.append(root_path / name)
+    return collected
+
 
 class Smali:
     def __init__(self, path: Path):
         self.path = path
-        with open(self.path, "r", encoding="utf8") as f:
-            self.content = f.readlines()
+        # One read + one split instead of pushing every line through the io
+        # stack; entry activity files can be megabytes of smali
+        self.content = self.path.read_text(encoding="utf8").splitlines(keepends=True)
+        self._dirty = False
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        # save() itself skips clean instances, so aborted attempts are safe
+        self.save()
+
+    def save(self):
+        # Unmodified instances (losing fallback candidates, plain lookups)
+        # must not rewrite multi-megabyte files they never touched
+        if not self._dirty:
+            return
+        self.path.write_text("".join(self.content), encoding="utf8")
 
     @staticmethod
     def find(temp_path: Path, entrypoint: str):
+        return Smali(Smali._find_path(temp_path, entrypoint))
+
+    # Pure (temp_path, entrypoint) -> Path resolution; memoized so repeated
+    # lookups in one process (batch runs, fallback retries) skip the walk
+    @staticmethod
+    @functools.lru_cache(maxsize=256)
+    def _find_path(temp_path: Path, entrypoint: str) -> Path:
         target_smali = entrypoint.split(".")[-1] + ".smali"
         package_path = entrypoint.replace(".", "/")
 
         Logger.info(f"Looking for {target_smali}...")
         Logger.info(f"Package path: {package_path}")
 
-        # Check all possible Smali directories
-        smali_dirs = ["smali", "smali_classes2", "smali_classes3", "smali_classes4", "smali_classes5", "smali_classes6"]
-        
         # First, try exact package path in all directories
-        for dir_name in smali_dirs:
-            smali_dir = temp_path / dir_name
-            if smali_dir.exists():
-                exact_path = smali_dir / package_path / target_smali
-                if exact_path.exists():
-                    Logger.info(f"✅ Found at exact path")
-                    return Smali(exact_path)
-        
+        for dir_name in SMALI_DIRS:
+            exact_path = temp_path / dir_name / package_path / target_smali
+            if exact_path.exists():
+                Logger.info(f"✅ Found at exact path")
+                return exact_path
+
+        # The remaining phases share a single directory walk; re-running
+        # rglob per phase re-stats tens of thousands of files
+        all_smali = _collect_smali(temp_path)
+        by_name: dict[str, Path] = {}
+        for child in all_smali:
+            by_name.setdefault(child.name, child)
+
         # If exact path not found, search by filename in all directories
         Logger.info("🔍 Searching by filename...")
-        for dir_name in smali_dirs:
-            smali_dir = temp_path / dir_name
-            if smali_dir.exists():
-                for child in smali_dir.rglob("*"):
-                    if child.name == target_smali:
-                        Logger.info(f"✅ Found by filename")
-                        return Smali(child)
-        
+        found = by_name.get(target_smali)
+        if found is not None:
+            Logger.info(f"✅ Found by filename")
+            return found
+
         # If still not found, search for Unity patterns in all directories
         Logger.info("🔍 Searching for Unity activities...")
-        unity_patterns = [
-            "UnityPlayer", "UnityActivity", "MessagingUnityPlayer", "Unity",
-            "Firebase", "Messaging", "Player", "Activity", "Main"
-        ]
-        
-        for dir_name in smali_dirs:
-            smali_dir = temp_path / dir_name
-            if smali_dir.exists():
-                for child in smali_dir.rglob("*"):
-                    if child.name.endswith(".smali"):
-                        for pattern in unity_patterns:
-                            if pattern in child.name:
-                                Logger.info(f"✅ Found Unity activity")
-                                return Smali(child)
-        
+        for child in all_smali:
+            if _UNITY_RE.search(child.name):
+                Logger.info(f"✅ Found Unity activity")
+                return child
+
         # Last resort: show what Smali files exist for debugging
         Logger.info("❌ No Unity activities found")
-        total_smali_files = 0
-        
-        # Count total Smali files for debugging
-        for dir_name in smali_dirs:
-            smali_dir = temp_path / dir_name
-            if smali_dir.exists():
-                smali_files = list(smali_dir.rglob("*.smali"))
-                total_smali_files += len(smali_files)
-        
-        Logger.info(f"📊 Total .smali files: {total_smali_files}")
-        
+        Logger.info(f"📊 Total .smali files: {len(all_smali)}")
+
         raise RuntimeError(f"Couldn't find smali containing entrypoint ({entrypoint})")
 
     def find_inject_point(self, start: int) -> int:
         pos = start
         in_annotation = False
-        
-        # Optimize by checking common patterns first
-        common_patterns = [".locals", ".annotation", ".end annotation"]
-        
+
         while pos + 1 < len(self.content):
             pos = pos + 1
-            line = self.content[pos].strip()
+            raw = self.content[pos]
 
             # skip empty lines
-            if not line:
+            if not raw or raw.isspace():
                 continue
 
-            # Fast pattern matching
-            if any(pattern in line for pattern in common_patterns):
-                if line.startswith(".locals "):
-                    continue
-                elif line.startswith(".annotation "):
-                    in_annotation = True
-                    continue
-                elif line.startswith(".end annotation"):
+            # Skip indentation by index instead of allocating a stripped
+            # copy of every line; startswith takes the offset directly
+            indent = 0
+            while raw[indent] in " \t":
+                indent += 1
+
+            # Single first-character dispatch - the old version scanned each
+            # line up to four times for the same anchored prefixes (a
+            # generator frame per line for the any() alone)
+            if raw[indent] == ".":
+                if raw.startswith((".locals ", ".annotation "), indent):
+                    in_annotation = raw[indent + 1] == "a"
+                elif raw.startswith(".end annotation", indent):
                     in_annotation = False
-                    continue
-                elif in_annotation:
-                    continue
-                else:
-                    return pos - 1
-
-            # If not a common pattern, check if it's a valid injection point
-            if not in_annotation and not line.startswith("."):
+                # other directives (.prologue, .param, ...) are skipped
+                continue
+
+            # First instruction outside an annotation is the injection point
+            if not in_annotation:
                 return pos - 1
-                
+
         raise RuntimeError("Failed to determine injection point")
 
     def find_end_of_method(self, start: int) -> int:
         # Optimize by searching backwards from a reasonable limit
         search_limit = min(start + 100, len(self.content))
-        
-        for i in range(start, search_limit):
-            if ".end method" in self.content[i]:
-                end_of_method = i - 1
-                
-                # Check if the method has a return type call
-                if "return" in self.content[end_of_method]:
-                    end_of_method -= 1
-                
-                return end_of_method
-        
-        # Fallback to original method if not found in reasonable range
-        end_methods = [(i + start) for i, x in enumerate(self.content[start:]) if ".end method" in x]
-        
-        if len(end_methods) <= 0:
-            raise RuntimeError("Couldn't find the end of the existing constructor")
-
-        end_of_method = end_methods[0] - 1
+
+        # Scan the window as one string: a single C-level find instead of a
+        # Python-dispatched substring check per line
+        window = "".join(self.content[start:search_limit])
+        offset = window.find(".end method")
+        if offset != -1:
+            end_of_method = start + window.count("\n", 0, offset) - 1
+        else:
+            # Method longer than the window: continue the same joined-text
+            # scan over the remaining tail instead of a per-line pass that
+            # indexes every trailing line
+            tail = "".join(self.content[search_limit:])
+            offset = tail.find(".end method")
+            if offset == -1:
+                raise RuntimeError("Couldn't find the end of the existing constructor")
+            end_of_method = search_limit + tail.count("\n", 0, offset) - 1
 
         # check if the constructor has a return type call. if it does,
         # move up one line again to inject our loadLibrary before the return
@@ -142,56 +172,48 @@ class Smali:
             Logger.debug("<init> is present in entry activity")
 
             inject_point = self.find_inject_point(marker)
-
-            self.content = self.content[:inject_point] + (SMALI_PARTIAL_LOAD_LIBRARY % library_name).splitlines(keepends=True) + self.content[inject_point:]
+            new_lines = (SMALI_PARTIAL_LOAD_LIBRARY % library_name).splitlines(keepends=True)
 
         else:
             Logger.debug("<init> is NOT present in entry activity")
 
-            self.content = self.content[:marker] + (SMALI_FULL_LOAD_LIBRARY % library_name).splitlines(keepends=True) + self.content[marker:]
+            inject_point = marker
+            new_lines = (SMALI_FULL_LOAD_LIBRARY % library_name).splitlines(keepends=True)
+
+        # In-place splice only shifts the tail; rebuilding via slicing
+        # copied the entire line list twice
+        self.content[inject_point:inject_point] = new_lines
+        self._dirty = True
 
     def update_locals(self, marker: int):
         end_of_method = self.find_end_of_method(marker)
 
-        defined_locals = [i for i, x in enumerate(self.content[marker:end_of_method]) if ".locals" in x]
+        # Single pass that stops at the first .locals; the old version built
+        # a full index list (over a sliced copy) just to take element [0]
+        for i in range(marker, end_of_method):
+            match = _LOCALS_RE.match(self.content[i])
+            if match:
+                self.content[i] = f"{match.group(1)}{int(match.group(2)) + 1}\n"
+                self._dirty = True
+                return
 
-        if len(defined_locals) <= 0:
-            Logger.warn("Couldn't determine any .locals for the target constructor")
-
-        # determine the offset for the first matched .locals definition
-        locals_smali_offset = defined_locals[0] + marker
-
-        try:
-            defined_local_value = self.content[locals_smali_offset].split(" ")[-1]
-            defined_local_value_as_int = int(defined_local_value, 10)
-            new_locals_value = defined_local_value_as_int + 1
-
-        except ValueError:
-            Logger.warn("Couldn't parse .locals value for the injected constructor")
-            return
-
-        self.content[locals_smali_offset] = self.content[locals_smali_offset].replace(str(defined_local_value_as_int), str(new_locals_value))
+        Logger.warn("Couldn't determine any .locals for the target constructor")
 
     def perform_injection(self, library_name: str):
         library_name = library_name.replace("lib", "").replace(".so", "")
         Logger.info(f'Injecting loadLibrary("{library_name}")')
 
-        marker = [i for i, x in enumerate(self.content) if "# direct methods" in x]
+        # Short-circuit on the first match; the marker sits near the top of
+        # the file so scanning the whole thing into a list was pure waste
+        marker = next((i for i, x in enumerate(self.content) if "# direct methods" in x), -1)
 
         # ensure we got a marker
-        if len(marker) <= 0:
+        if marker < 0:
             raise RuntimeError("Couldn't determine position to inject a loadLibrary call")
 
-        # pick the first position for the inject. add one line as we
-        # want to inject right below the comment we matched
-        marker_value = marker[0] + 1
+        # add one line as we want to inject right below the comment we matched
+        marker_value = marker + 1
 
         self.put_load_library(library_name, marker_value)
         self.update_locals(marker_value)
-
-    def __del__(self):
-        try:
-            with open(self.path, "w", encoding="utf8") as f:
-                f.writelines(self.content)
-        except IOError as e:
-            Logger.error(f"Failed to write smali file {self.path}: {e}")
+        self._dirty = True
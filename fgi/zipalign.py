@@ -0,0 +1,117 @@
+import struct
+from pathlib import Path
+
+from fgi.logger import Logger
+
+_LFH_SIGNATURE = b"PK\x03\x04"
+_CDH_SIGNATURE = b"PK\x01\x02"
+_EOCD_SIGNATURE = b"PK\x05\x06"
+_LFH_STRUCT = struct.Struct("<4sHHHHHIIIHH")
+_CDH_STRUCT = struct.Struct("<4sHHHHHHIIIHHHHHII")
+_EOCD_STRUCT = struct.Struct("<4sHHHHIIH")
+_STORED = 0
+
+
+class ZipAlignError(RuntimeError):
+    """Raised when an archive can't be aligned in-process (caller should fall back)"""
+
+
+def align(src: Path, dst: Path, alignment: int = 4, page_alignment: int = 4096):
+    """Align stored entries of a ZIP/APK without recompressing anything
+
+    zipalign is a pure header rewrite: uncompressed entries get zero padding
+    appended to their local-file-header extra field so the entry *data*
+    starts on a 4-byte boundary (page boundary for .so files), and the
+    central directory offsets are fixed up to match. Compressed entries and
+    everything between the headers are copied verbatim, so the whole pass is
+    one read and one sequential write instead of a subprocess that re-parses
+    the archive.
+    """
+    data = src.read_bytes()
+
+    eocd_offset = data.rfind(_EOCD_SIGNATURE)
+    if eocd_offset < 0:
+        raise ZipAlignError("No end-of-central-directory record found")
+    try:
+        _, disk, cd_disk, _, entry_count, cd_size, cd_offset, _ = _EOCD_STRUCT.unpack_from(data, eocd_offset)
+    except struct.error:
+        raise ZipAlignError("Truncated end-of-central-directory record")
+    if disk != 0 or cd_disk != 0:
+        raise ZipAlignError("Multi-disk archives are not supported")
+    if entry_count == 0xFFFF or cd_size == 0xFFFFFFFF or cd_offset == 0xFFFFFFFF:
+        raise ZipAlignError("ZIP64 archives are not supported")
+
+    # Walk the central directory once; it knows every entry's method, sizes
+    # and local header offset
+    entries = []
+    cd_cursor = cd_offset
+    for _ in range(entry_count):
+        try:
+            fields = _CDH_STRUCT.unpack_from(data, cd_cursor)
+        except struct.error:
+            raise ZipAlignError("Truncated central directory")
+        if fields[0] != _CDH_SIGNATURE:
+            raise ZipAlignError("Bad central directory signature")
+        name_len, extra_len, comment_len = fields[10], fields[11], fields[12]
+        name = data[cd_cursor + 46 : cd_cursor + 46 + name_len]
+        entries.append(
+            {
+                "cd_offset": cd_cursor,
+                "cd_len": 46 + name_len + extra_len + comment_len,
+                "method": fields[4],
+                "name": name,
+                "lfh_offset": fields[16],
+            }
+        )
+        cd_cursor += 46 + name_len + extra_len + comment_len
+
+    output = bytearray()
+    new_offsets: dict[int, int] = {}
+    cursor = 0
+
+    for entry in sorted(entries, key=lambda e: e["lfh_offset"]):
+        lfh_offset = entry["lfh_offset"]
+        if lfh_offset < cursor:
+            raise ZipAlignError("Overlapping local file entries")
+        # Preserve any bytes between entries verbatim
+        output += data[cursor:lfh_offset]
+
+        try:
+            lfh = _LFH_STRUCT.unpack_from(data, lfh_offset)
+        except struct.error:
+            raise ZipAlignError("Truncated local file header")
+        if lfh[0] != _LFH_SIGNATURE:
+            raise ZipAlignError("Bad local file header signature")
+        name_len, extra_len = lfh[9], lfh[10]
+        extra_end = lfh_offset + 30 + name_len + extra_len
+
+        padding = 0
+        if entry["method"] == _STORED:
+            required = page_alignment if entry["name"].endswith(b".so") else alignment
+            data_start = len(output) + 30 + name_len + extra_len
+            padding = (required - data_start % required) % required
+            if extra_len + padding > 0xFFFF:
+                raise ZipAlignError("Extra field too large to pad")
+
+        new_offsets[lfh_offset] = len(output)
+        output += _LFH_STRUCT.pack(*lfh[:10], extra_len + padding)
+        output += data[lfh_offset + 30 : extra_end]
+        output += b"\x00" * padding
+        cursor = extra_end
+
+    # Entry data (and data descriptors) up to the central directory
+    output += data[cursor:cd_offset]
+
+    # Rewrite the central directory with fixed-up local header offsets
+    new_cd_offset = len(output)
+    for entry in entries:
+        record = bytearray(data[entry["cd_offset"] : entry["cd_offset"] + entry["cd_len"]])
+        struct.pack_into("<I", record, 42, new_offsets[entry["lfh_offset"]])
+        output += record
+
+    eocd = bytearray(data[eocd_offset:])
+    struct.pack_into("<I", eocd, 16, new_cd_offset)
+    output += eocd
+
+    dst.write_bytes(output)
+    Logger.debug(f"Aligned {len(entries)} entries in-process ({len(output) - len(data)} padding bytes)")